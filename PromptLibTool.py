@@ -1,33 +1,44 @@
 import streamlit as st
 import pandas as pd
+import csv
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import os
-
-# Import necessary libraries for Google Drive integration
-from google.colab import drive
+import threading
+import functools
 
 # --- Google Drive Setup ---
-# Mount Google Drive
-try:
+# Only a successful mount is cached; if it raises nothing is stored and the
+# next run tries again
+@st.cache_resource(show_spinner=False)
+def _mount_drive() -> str:
+    # Only available in Google Colab, so import it here rather than at the top
+    from google.colab import drive
     drive.mount('/content/drive')
     # Define your Google Drive directory where you want to store the CSVs
     # Make sure this directory exists in your Google Drive
-    GOOGLE_DRIVE_DIR = '/content/drive/MyDrive/Streamlit_Prompts'
-    os.makedirs(GOOGLE_DRIVE_DIR, exist_ok=True) # Create directory if it doesn't exist
+    drive_dir = '/content/drive/MyDrive/Streamlit_Prompts'
+    os.makedirs(drive_dir, exist_ok=True) # Create directory if it doesn't exist
+    return drive_dir
+
+def _ensure_drive() -> Tuple[str, Optional[Exception]]:
+    try:
+        return _mount_drive(), None
+    except Exception as e:
+        return '.', e # Fallback to local directory if mounting fails (for local testing)
 
-except Exception as e:
-    st.error(f"Error mounting Google Drive: {e}. Please ensure you are running this in Google Colab and have granted permissions.")
-    GOOGLE_DRIVE_DIR = '.' # Fallback to local directory if mounting fails (for local testing)
+# Set once per run by main()
+GOOGLE_DRIVE_DIR = '.'
 
 # Constants
 ELEMENT_TYPES = ['role', 'goal', 'audience', 'context', 'output', 'tone']
 CSV_COLUMNS = ['title', 'type', 'content']
 PROMPT_HISTORY_COLUMNS = ['name', 'timestamp', 'prompt']
+_FMT = 'parquet'
+PROMPT_PAGE_SIZE = 20
 
 # Custom theme and styling
-def set_theme():
-    st.markdown("""
+_THEME_CSS = """
     <style>
     /* Modern dark theme inspired by shadcn */
     :root {
@@ -107,39 +118,150 @@ def set_theme():
         color: var(--foreground);
     }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def set_theme():
+    # Streamlit drops elements that are not re-emitted on a rerun, so this is
+    # deliberately not gated on session state or the theme would vanish
+    st.markdown(_THEME_CSS, unsafe_allow_html=True)
 
 # Data management
+@st.cache_data(ttl=300, show_spinner=False)
+def _read_table_cached(path: str, mtime: float, columns: List[str]) -> pd.DataFrame:
+    # mtime is only part of the cache key so that edits to the file invalidate it
+    return pd.read_parquet(path, columns=columns)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _read_csv_cached(path: str, mtime: float, columns: List[str]) -> pd.DataFrame:
+    return pd.read_csv(path, usecols=columns)
+
+# The page and row count are cached separately from the full read so a hit
+# only unpickles one page rather than the whole history
+@st.cache_data(ttl=300, show_spinner=False)
+def _read_history_page(path: str, mtime: float, start: int, stop: int) -> pd.DataFrame:
+    return _read_csv_cached(path, mtime, PROMPT_HISTORY_COLUMNS).iloc[start:stop].copy()
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _count_history(path: str, mtime: float) -> int:
+    return len(_read_csv_cached(path, mtime, PROMPT_HISTORY_COLUMNS))
+
 class DataManager:
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def _get_full_path(filename: str) -> str:
         return os.path.join(GOOGLE_DRIVE_DIR, filename)
 
+    @staticmethod
+    def _get_table_path(filename: str) -> str:
+        # Data is stored as Parquet next to where the original CSV lived
+        return DataManager._get_full_path(f"{os.path.splitext(filename)[0]}.{_FMT}")
+
     @staticmethod
     def load_data(filename: str, columns: List[str]) -> pd.DataFrame:
-        full_path = DataManager._get_full_path(filename)
+        full_path = DataManager._get_table_path(filename)
         try:
-            return pd.read_csv(full_path)
+            return _read_table_cached(full_path, os.path.getmtime(full_path), columns)
         except FileNotFoundError:
-            df = pd.DataFrame(columns=columns)
-            df.to_csv(full_path, index=False)
-            return df
+            # One-shot migration from the CSV files used by earlier versions
+            csv_path = DataManager._get_full_path(filename)
+            if os.path.exists(csv_path):
+                df = pd.read_csv(csv_path, dtype=str)
+            else:
+                df = pd.DataFrame(columns=columns)
+            df.to_parquet(full_path, index=False, compression='zstd')
+            return df[columns]
 
     @staticmethod
     def save_data(df: pd.DataFrame, filename: str) -> None:
-        full_path = DataManager._get_full_path(filename)
-        df.to_csv(full_path, index=False)
+        full_path = DataManager._get_table_path(filename)
+        df.to_parquet(full_path, index=False, compression='zstd')
+        _read_table_cached.clear()
+
+    @staticmethod
+    def sync_store(store: Dict[str, Any]) -> pd.DataFrame:
+        # Caller holds store['lock']. Reload when the file changed outside this
+        # process, e.g. another app instance writing to the same Drive folder
+        full_path = DataManager._get_table_path(store['filename'])
+        try:
+            mtime = os.path.getmtime(full_path)
+        except FileNotFoundError:
+            mtime = None
+        if store['df'] is None or mtime != store['mtime']:
+            store['df'] = DataManager.load_data(store['filename'], store['columns'])
+            store['mtime'] = os.path.getmtime(full_path)
+            store['version'] += 1
+        return store['df']
+
+    @staticmethod
+    def save_store(store: Dict[str, Any], df: pd.DataFrame) -> None:
+        # Caller holds store['lock']
+        DataManager.save_data(df, store['filename'])
+        store['df'] = df
+        store['mtime'] = os.path.getmtime(DataManager._get_table_path(store['filename']))
+        store['version'] += 1
+
+    @staticmethod
+    def flush_pending(buffer_key: str, store: Dict[str, Any]) -> int:
+        # Rows are buffered as plain dicts and turned into a DataFrame in one go,
+        # so adding a row never copies the whole frame
+        pending = st.session_state.setdefault(buffer_key, [])
+        if not pending:
+            return 0
+        new_df = pd.DataFrame(pending, columns=store['columns'])
+        with store['lock']:
+            df = DataManager.sync_store(store)
+            # Matching dtypes keeps concat from upcasting or consolidating mismatched blocks
+            new_df = new_df.astype(df.dtypes.to_dict())
+            DataManager.save_store(store, pd.concat([df, new_df], ignore_index=True))
+        count = len(pending)
+        pending.clear()
+        return count
+
+    @staticmethod
+    def load_history_page(start: int, stop: int) -> Tuple[pd.DataFrame, int]:
+        # Prompt history stays a CSV so saving a prompt can append a single line
+        full_path = DataManager._get_full_path('prompt_history.csv')
+        try:
+            mtime = os.path.getmtime(full_path)
+            return (_read_history_page(full_path, mtime, start, stop),
+                    _count_history(full_path, mtime))
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            return pd.DataFrame(columns=PROMPT_HISTORY_COLUMNS), 0
 
     @staticmethod
     def save_prompt(name: str, prompt: str) -> None:
-        df = DataManager.load_data('prompt_history.csv', PROMPT_HISTORY_COLUMNS)
-        new_row = pd.DataFrame({
-            'name': [name],
-            'timestamp': [datetime.now()],
-            'prompt': [prompt]
-        })
-        df = pd.concat([df, new_row], ignore_index=True)
-        DataManager.save_data(df, 'prompt_history.csv')
+        full_path = DataManager._get_full_path('prompt_history.csv')
+        try:
+            write_header = os.path.getsize(full_path) == 0
+        except FileNotFoundError:
+            write_header = True
+        with open(full_path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(PROMPT_HISTORY_COLUMNS)
+            writer.writerow([name, datetime.now().isoformat(sep=' '), prompt])
+        _read_csv_cached.clear()
+        _read_history_page.clear()
+        _count_history.clear()
+
+@st.cache_resource
+def get_elements_store() -> Dict[str, Any]:
+    # One elements frame shared by every session; treat store['df'] as read-only
+    # and do read-modify-write through sync_store/save_store under the lock
+    return {
+        'filename': 'prompt_elements.csv',
+        'columns': CSV_COLUMNS,
+        'df': None,
+        'mtime': None,
+        # Bumped whenever 'df' is replaced, since row indices may shift with it
+        'version': 0,
+        'lock': threading.Lock()
+    }
+
+def get_elements_df() -> pd.DataFrame:
+    store = get_elements_store()
+    with store['lock']:
+        return DataManager.sync_store(store)
 
 # UI Components
 class ElementCreator:
@@ -153,17 +275,48 @@ class ElementCreator:
             with col2:
                 content = st.text_area("Content", key="new_content", height=100)
 
-            if st.button("Add Element", key="add_element"):
-                df = DataManager.load_data('prompt_elements.csv', CSV_COLUMNS)
-                new_row = pd.DataFrame({'title': [title], 'type': [element_type], 'content': [content]})
-                df = pd.concat([df, new_row], ignore_index=True)
-                DataManager.save_data(df, 'prompt_elements.csv')
-                st.success("Element added successfully!")
+            pending = st.session_state.setdefault('pending_elements', [])
+
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Add Element", key="add_element"):
+                    pending.append({'title': title, 'type': element_type, 'content': content})
+                    st.success("Element added! Click Save Elements to store it.")
+            with col2:
+                if st.button("Save Elements", key="save_elements"):
+                    count = DataManager.flush_pending('pending_elements', get_elements_store())
+                    st.success(f"Saved {count} element(s) successfully!")
+
+            if pending:
+                st.info(f"{len(pending)} element(s) waiting to be saved.")
 
 class ElementEditor:
     @staticmethod
     def render():
-        df = DataManager.load_data('prompt_elements.csv', CSV_COLUMNS)
+        # Edits are staged in session state as operations and applied to the
+        # current shared frame in one write on commit
+        store = get_elements_store()
+        with store['lock']:
+            df = DataManager.sync_store(store)
+            version = store['version']
+        skipped = ElementEditor._rebase_edits(df, version)
+        edits = ElementEditor._pending_edits()
+        notice = st.session_state.pop('elements_notice', None)
+        if skipped:
+            notice = (f"{skipped} staged change(s) were dropped because the element was "
+                      "changed or removed elsewhere.")
+        if edits:
+            df, _ = ElementEditor._apply_edits(df, edits)
+            col1, col2, col3 = st.columns([2, 1, 1])
+            with col1:
+                st.info(notice or "You have uncommitted changes.")
+            with col2:
+                # Committed in the callback so the rerun it triggers renders the saved state
+                st.button("Commit changes", key="commit_elements", on_click=ElementEditor._commit)
+            with col3:
+                st.button("Discard changes", key="discard_elements", on_click=ElementEditor._discard)
+        elif notice:
+            st.success(notice)
 
         if df.empty:
             st.warning("No elements found. Please create some elements first.")
@@ -182,68 +335,171 @@ class ElementEditor:
             return
 
         # Element list with editing capabilities
-        for index, row in filtered_df.iterrows():
-            ElementEditor._render_element(index, row, df)
+        for index, title, element_type, content in filtered_df[CSV_COLUMNS].itertuples(index=True, name=None):
+            ElementEditor._render_element(index, {'title': title, 'type': element_type, 'content': content},
+                                          version)
+
+    @staticmethod
+    def _pending_edits() -> Dict[int, Dict[str, Any]]:
+        # index -> {'original': row as first seen, 'new': new values or None to delete}
+        return st.session_state.setdefault('element_edits', {})
 
     @staticmethod
-    def _render_element(index: int, row: Dict[str, Any], df: pd.DataFrame):
+    def _rebase_edits(df: pd.DataFrame, version: int) -> int:
+        # Staged edits are keyed by row index, which is only meaningful for the
+        # store version they were made against; re-key them when it changes
+        if st.session_state.get('element_edits_version') == version:
+            return 0
+        edits = ElementEditor._pending_edits()
+        rebased = {}
+        skipped = 0
+        for index, edit in edits.items():
+            target = ElementEditor._locate(df, index, edit['original'])
+            if target is None:
+                skipped += 1
+            else:
+                rebased[target] = edit
+        edits.clear()
+        edits.update(rebased)
+        st.session_state['element_edits_version'] = version
+        return skipped
+
+    @staticmethod
+    def _locate(df: pd.DataFrame, index: int, original: Dict[str, Any]) -> Optional[int]:
+        # Find the row an edit was made against, even if other saves moved it
+        mask = pd.Series(True, index=df.index)
+        for col in CSV_COLUMNS:
+            value = original[col]
+            mask &= df[col].isna() if pd.isna(value) else df[col] == value
+        matches = df.index[mask]
+        if index in matches:
+            return index
+        return matches[0] if len(matches) else None
+
+    @staticmethod
+    def _apply_edits(df: pd.DataFrame, edits: Dict[int, Dict[str, Any]]) -> Tuple[pd.DataFrame, int]:
+        df = df.copy()
+        dropped = []
+        skipped = 0
+        for index, edit in edits.items():
+            target = ElementEditor._locate(df, index, edit['original'])
+            if target is None:
+                skipped += 1
+            elif edit['new'] is None:
+                dropped.append(target)
+            else:
+                for col, value in edit['new'].items():
+                    df.at[target, col] = value
+        return df.drop(dropped), skipped
+
+    @staticmethod
+    def _is_current(version: int) -> bool:
+        # Staged edits are indexed against 'element_edits_version'; a click from
+        # widgets rendered for another version would land on the wrong row
+        if version == st.session_state.get('element_edits_version'):
+            return True
+        st.session_state['elements_notice'] = ("The elements changed before your change was "
+                                               "applied. Please make it again.")
+        return False
+
+    @staticmethod
+    def _update(index: int, row: Dict[str, Any], version: int) -> None:
+        if not ElementEditor._is_current(version):
+            return
+        edit = ElementEditor._pending_edits().setdefault(index, {'original': row})
+        edit['new'] = {col: st.session_state[ElementEditor._widget_key(col, index, version)]
+                       for col in CSV_COLUMNS}
+        st.session_state['elements_notice'] = "Updated! Click Commit changes to save."
+
+    @staticmethod
+    def _delete(index: int, row: Dict[str, Any], version: int) -> None:
+        if not ElementEditor._is_current(version):
+            return
+        ElementEditor._pending_edits().setdefault(index, {'original': row})['new'] = None
+        st.session_state['elements_notice'] = "Deleted! Click Commit changes to save."
+
+    @staticmethod
+    def _commit() -> None:
+        store = get_elements_store()
+        edits = ElementEditor._pending_edits()
+        with store['lock']:
+            # Apply to whatever is current so saves from other sessions are kept
+            df, skipped = ElementEditor._apply_edits(DataManager.sync_store(store), edits)
+            DataManager.save_store(store, df.reset_index(drop=True))
+        edits.clear()
+        st.session_state['elements_notice'] = "Changes saved successfully!"
+        if skipped:
+            st.session_state['elements_notice'] += (
+                f" {skipped} change(s) were skipped because the element was changed or removed elsewhere.")
+
+    @staticmethod
+    def _discard() -> None:
+        ElementEditor._pending_edits().clear()
+        st.session_state['elements_notice'] = "Changes discarded."
+
+    @staticmethod
+    def _widget_key(col: str, index: int, version: int) -> str:
+        # Streamlit keeps a keyed widget's state even when value= changes, so the
+        # key includes the store version; when indices shift the widgets start fresh
+        return f"{col}_{version}_{index}"
+
+    @staticmethod
+    def _render_element(index: int, row: Dict[str, Any], version: int):
         with st.expander(f"{row['title']} ({row['type']})", expanded=False):
             col1, col2 = st.columns(2)
             with col1:
-                new_title = st.text_input("Title", value=row['title'], key=f"title_{index}")
-                new_type = st.selectbox("Type", ELEMENT_TYPES,
-                                         index=ELEMENT_TYPES.index(row['type']),
-                                         key=f"type_{index}")
+                st.text_input("Title", value=row['title'],
+                              key=ElementEditor._widget_key('title', index, version))
+                st.selectbox("Type", ELEMENT_TYPES,
+                             index=ELEMENT_TYPES.index(row['type']),
+                             key=ElementEditor._widget_key('type', index, version))
             with col2:
-                new_content = st.text_area("Content", value=row['content'],
-                                             key=f"content_{index}", height=100)
+                st.text_area("Content", value=row['content'],
+                             key=ElementEditor._widget_key('content', index, version), height=100)
 
+            # Callbacks run before the rerun the click triggers, so that one
+            # rerun already renders the staged change
             col1, col2 = st.columns(2)
             with col1:
-                if st.button("Update", key=f"update_{index}"):
-                    df.at[index, 'title'] = new_title
-                    df.at[index, 'type'] = new_type
-                    df.at[index, 'content'] = new_content
-                    DataManager.save_data(df, 'prompt_elements.csv')
-                    st.success("Updated successfully!")
-                    st.experimental_rerun()
+                st.button("Update", key=f"update_{index}",
+                          on_click=ElementEditor._update, args=(index, row, version))
             with col2:
-                if st.button("Delete", key=f"delete_{index}"):
-                    df = df.drop(index)
-                    DataManager.save_data(df, 'prompt_elements.csv')
-                    st.success("Deleted successfully!")
-                    st.experimental_rerun()
+                st.button("Delete", key=f"delete_{index}",
+                          on_click=ElementEditor._delete, args=(index, row, version))
 
 class PromptBuilder:
     @staticmethod
     def render():
-        df = DataManager.load_data('prompt_elements.csv', CSV_COLUMNS)
+        df = get_elements_df()
+        by_type = df.groupby('type')['title'].apply(list).to_dict()
+        # First element wins for duplicate titles, as with the old per-title scans
+        content_by_title = df.drop_duplicates('title').set_index('title')['content']
 
         # Layout the form in a grid
         col1, col2, col3 = st.columns(3)
         selections = {}
 
         with col1:
-            selections['role'] = PromptBuilder._create_section("Role", 'role', df)
-            selections['goal'] = PromptBuilder._create_section("Goal", 'goal', df)
+            selections['role'] = PromptBuilder._create_section("Role", 'role', by_type)
+            selections['goal'] = PromptBuilder._create_section("Goal", 'goal', by_type)
         with col2:
-            selections['audience'] = PromptBuilder._create_section("Target Audience", 'audience', df, True)
-            selections['context'] = PromptBuilder._create_section("Context", 'context', df, True)
+            selections['audience'] = PromptBuilder._create_section("Target Audience", 'audience', by_type, True)
+            selections['context'] = PromptBuilder._create_section("Context", 'context', by_type, True)
         with col3:
-            selections['output'] = PromptBuilder._create_section("Output", 'output', df, True)
-            selections['tone'] = PromptBuilder._create_section("Tone", 'tone', df)
+            selections['output'] = PromptBuilder._create_section("Output", 'output', by_type, True)
+            selections['tone'] = PromptBuilder._create_section("Tone", 'tone', by_type)
 
         recursive_feedback = st.checkbox("Request recursive feedback")
 
         # Generate and display prompt
-        prompt = PromptBuilder._generate_prompt(selections, df, recursive_feedback)
+        prompt = PromptBuilder._generate_prompt(selections, content_by_title, recursive_feedback)
         PromptBuilder._display_prompt(prompt)
 
     @staticmethod
-    def _create_section(title: str, element_type: str, df: pd.DataFrame,
+    def _create_section(title: str, element_type: str, by_type: Dict[str, List[str]],
                          multi_select: bool = False) -> Dict[str, Any]:
-        elements = df[df['type'] == element_type]
-        options = ["Skip", "Write your own"] + elements['title'].tolist()
+        elements = by_type.get(element_type, [])
+        options = ["Skip", "Write your own"] + elements
 
         if multi_select:
             selected = st.multiselect(title, options, key=f"select_{element_type}")
@@ -262,7 +518,7 @@ class PromptBuilder:
         }
 
     @staticmethod
-    def _generate_prompt(selections: Dict[str, Dict], df: pd.DataFrame,
+    def _generate_prompt(selections: Dict[str, Dict], content_by_title: pd.Series,
                          recursive_feedback: bool) -> str:
         prompt_parts = []
 
@@ -274,14 +530,14 @@ class PromptBuilder:
             section_title = section.title()
             if section in ['audience', 'context', 'output']:
                 section_title = f"Target {section_title}" if section == 'audience' else section_title
+                picks = [a for a in data['selected'] if a not in ("Skip", "Write your own")]
                 content = data['custom'] if "Write your own" in data['selected'] else \
-                                "\n".join([df[df['title'] == a]['content'].values[0]
-                                            for a in data['selected'] if a != "Skip" and a != "Write your own"])
+                                "\n".join(content_by_title.reindex(picks).dropna().tolist())
                 if content:
                     prompt_parts.append(f"{section_title}:\n{content}")
             else:
                 content = data['custom'] if data['selected'] == "Write your own" else \
-                                df[df['title'] == data['selected']]['content'].values[0]
+                                content_by_title[data['selected']]
                 prompt_parts.append(f"{section_title}: {content}")
 
         prompt = "\n\n".join(prompt_parts)
@@ -308,22 +564,34 @@ class PromptBuilder:
 class PromptBrowser:
     @staticmethod
     def render():
-        full_path = DataManager._get_full_path('prompt_history.csv')
-        try:
-            df = pd.read_csv(full_path)
-        except FileNotFoundError:
+        page = st.session_state.get('prompt_page', 1)
+        start = (page - 1) * PROMPT_PAGE_SIZE
+        page_df, total = DataManager.load_history_page(start, start + PROMPT_PAGE_SIZE)
+        if total == 0:
             st.warning("No prompts found. Please create and save some prompts first.")
             return
 
-        for index, row in df.iterrows():
+        page_count = (total - 1) // PROMPT_PAGE_SIZE + 1
+        st.number_input("Page", min_value=1, max_value=page_count, value=1,
+                        step=1, key="prompt_page")
+        st.caption(f"Showing {start + 1}-{start + len(page_df)} of {total} prompts")
+
+        for offset, row in enumerate(page_df.to_dict('records')):
+            index = start + offset
             with st.expander(f"{row['name']} - {row['timestamp']}", expanded=False):
                 st.text_area("Prompt Content", value=row['prompt'],
                              height=150, key=f"prompt_{index}")
 
 def main():
+    global GOOGLE_DRIVE_DIR
+
     st.set_page_config(layout="wide", page_title="KMo's Prompt Creation Tool")
     set_theme()
 
+    GOOGLE_DRIVE_DIR, error = _ensure_drive()
+    if error:
+        st.error(f"Error mounting Google Drive: {error}. Please ensure you are running this in Google Colab and have granted permissions.")
+
     st.title("KMo's Prompt Creation Tool")
 
     tabs = st.tabs(["Element Creator", "Element Editor", "Prompt Builder", "Browse Prompts"])
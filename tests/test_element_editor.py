@@ -0,0 +1,67 @@
+import os
+import re
+
+import pandas as pd
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'PromptLibTool.py')
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # The app falls back to the working directory when Google Drive is unavailable
+    monkeypatch.chdir(tmp_path)
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    pd.DataFrame({
+        'title': ['R0', 'R1', 'R2'],
+        'type': ['role', 'role', 'goal'],
+        'content': ['c0', 'c1', 'c2']
+    }).to_parquet('prompt_elements.parquet', index=False)
+    return AppTest.from_file(APP, default_timeout=30).run()
+
+
+def _widget(at, kind, col, index):
+    pattern = re.compile(rf"^{col}_\d+_{index}$")
+    return next(w for w in getattr(at, kind) if pattern.match(w.key or ''))
+
+
+def _stored_rows():
+    return pd.read_parquet('prompt_elements.parquet').values.tolist()
+
+
+def test_update_after_committed_delete_edits_the_right_row(app):
+    app.button(key='delete_0').click().run()
+    app.button(key='commit_elements').click().run()
+    assert _stored_rows() == [['R1', 'role', 'c1'], ['R2', 'goal', 'c2']]
+
+    # Rows shifted down one index; their widgets must show the new occupant
+    assert _widget(app, 'text_input', 'title', 1).value == 'R2'
+    assert _widget(app, 'selectbox', 'type', 1).value == 'goal'
+
+    _widget(app, 'text_area', 'content', 1).set_value('c2-edited')
+    app.button(key='update_1').click().run()
+    app.button(key='commit_elements').click().run()
+    assert _stored_rows() == [['R1', 'role', 'c1'], ['R2', 'goal', 'c2-edited']]
+
+
+def test_discard_drops_staged_changes(app):
+    app.button(key='delete_0').click().run()
+    app.button(key='discard_elements').click().run()
+    assert not app.exception
+    assert _stored_rows()[0] == ['R0', 'role', 'c0']
+    assert _widget(app, 'text_input', 'title', 0).value == 'R0'
+
+
+def test_update_survives_delete_committed_by_another_session(app):
+    other = AppTest.from_file(APP, default_timeout=30).run()
+    other.button(key='delete_0').click().run()
+    other.button(key='commit_elements').click().run()
+
+    # This session still shows the old layout, with R2 at index 2
+    _widget(app, 'text_area', 'content', 2).set_value('c2-edited')
+    app.button(key='update_2').click().run()
+    app.button(key='commit_elements').click().run()
+    assert _stored_rows() == [['R1', 'role', 'c1'], ['R2', 'goal', 'c2-edited']]